@@ -1,91 +1,170 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from flask_caching import Cache
+from flask_migrate import Migrate
+import msgspec
+import orjson
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from datetime import datetime, timedelta
+from dataclasses import dataclass
+from datetime import date as date_type, datetime, time, timedelta
 from models import db, User, Ride, RideRequest
+import atexit
 import os
 from dotenv import load_dotenv
 from google.cloud.sql.connector import Connector
 import sqlalchemy
+from sqlalchemy.orm import selectinload, joinedload, raiseload
+from sqlalchemy.exc import IntegrityError
 
 # Load environment variables
 load_dotenv()
 
+# orjson-backed JSON provider: serializes datetimes natively and is much
+# faster than the stdlib encoder used by Flask's default provider.
+class ORJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+app.url_map.strict_slashes = False
+
+def ojsonify(obj, status=200):
+    """jsonify equivalent that hands orjson's bytes straight to the Response,
+    skipping the str -> bytes re-encode jsonify would do."""
+    return Response(orjson.dumps(obj, option=orjson.OPT_NAIVE_UTC),
+                    status=status, mimetype='application/json')
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=1)
+app.config['BCRYPT_ROUNDS'] = int(os.getenv('BCRYPT_ROUNDS', '10'))
 
-# Initialize CORS and JWT
+# Redis cache for the read-heavy ride endpoints.
+app.config['CACHE_TYPE'] = os.getenv('CACHE_TYPE', 'RedisCache')
+app.config['CACHE_REDIS_URL'] = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+# Initialize CORS, JWT and cache
 CORS(app)
 jwt = JWTManager(app)
+cache = Cache(app)
+
+# Initialize Cloud SQL connection. One Connector per process: it owns the
+# IAM token refresher and TLS context, so recreating it per checkout would
+# redo TLS handshakes and leak background refresh tasks.
+connector = Connector()
+atexit.register(connector.close)
 
-# Initialize Cloud SQL connection
 def getconn():
-    connector = Connector()
-    conn = connector.connect(
+    return connector.connect(
         os.getenv('INSTANCE_CONNECTION_NAME'),
         "pymysql",
         user=os.getenv('DB_USER'),
         password=os.getenv('DB_PASS'),
         db=os.getenv('DB_NAME'),
+        charset='utf8mb4',
     )
-    return conn
-
-# Create SQLAlchemy engine with connection pooling
-pool = sqlalchemy.create_engine(
-    "mysql+pymysql://",
-    creator=getconn,
-    pool_size=5,
-    max_overflow=2,
-    pool_timeout=30,
-    pool_recycle=1800,
-)
 
-# Configure SQLAlchemy
-app.config['SQLALCHEMY_DATABASE_URI'] = pool.url
+# Configure SQLAlchemy. Flask-SQLAlchemy builds its own engine from the URI
+# and SQLALCHEMY_ENGINE_OPTIONS, so the Cloud SQL creator and pool settings
+# must go through the options dict to reach the engine the app actually uses.
+app.config['SQLALCHEMY_DATABASE_URI'] = "mysql+pymysql://"
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# The pool is sized for a multi-worker deployment so bursts don't stack up
+# behind pool_timeout waits.
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_pre_ping': True,
+    'creator': getconn,
+    'pool_size': 20,
+    'max_overflow': 10,
+    'pool_timeout': 30,
     'pool_recycle': 1800,
+    'pool_pre_ping': True,
+    'pool_use_lifo': True,
+    'query_cache_size': 1200,
 }
 
 # Initialize database
 db.init_app(app)
+migrate = Migrate(app, db)
+
+# Schema changes are applied once at deploy time via 'flask db upgrade'.
+# Creating tables at import would repeat the DDL round-trips in every
+# worker process; keep it opt-in for local development only.
+if os.getenv('RUN_MIGRATIONS'):
+    with app.app_context():
+        db.create_all()
+
+# Request body schemas. msgspec parses and validates the raw JSON in one C
+# pass, replacing request.get_json() plus manual key access.
+class RegisterBody(msgspec.Struct):
+    email: str
+    name: str
+    password: str
 
-# Create database tables
-with app.app_context():
-    db.create_all()
+class LoginBody(msgspec.Struct):
+    email: str
+    password: str
+
+class CreateRideBody(msgspec.Struct):
+    start_location: str
+    end_location: str
+    available_seats: int
+    departure_time: datetime
+    price: float
+
+class UpdateRideRequestBody(msgspec.Struct):
+    status: str
+
+def parse_body(schema):
+    try:
+        return msgspec.json.decode(request.get_data(), type=schema)
+    except msgspec.DecodeError as exc:
+        abort(ojsonify({'error': f'Invalid request body: {exc}'}, 400))
+
+def _loader_options(*opts):
+    """Loader options for read queries; in debug mode any relationship not
+    eagerly loaded raises instead of silently firing an N+1 query."""
+    if app.debug:
+        return (*opts, raiseload('*'))
+    return opts
 
 # Auth Routes
 @app.route('/api/auth/register', methods=['POST'])
 def register():
-    data = request.get_json()
-    
-    if User.query.filter_by(email=data['email']).first():
-        return jsonify({'error': 'Email already registered'}), 400
-    
+    body = parse_body(RegisterBody)
+
+    if User.query.filter_by(email=body.email).first():
+        return ojsonify({'error': 'Email already registered'}, 400)
+
     user = User(
-        email=data['email'],
-        name=data['name']
+        email=body.email,
+        name=body.name
     )
-    user.set_password(data['password'])
+    user.set_password(body.password)
     
     db.session.add(user)
     db.session.commit()
     
-    return jsonify({'message': 'User registered successfully'}), 201
+    return ojsonify({'message': 'User registered successfully'}, 201)
 
 @app.route('/api/auth/login', methods=['POST'])
 def login():
-    data = request.get_json()
-    user = User.query.filter_by(email=data['email']).first()
-    
-    if not user or not user.check_password(data['password']):
-        return jsonify({'error': 'Invalid credentials'}), 401
-    
+    body = parse_body(LoginBody)
+    user = User.query.filter_by(email=body.email).first()
+
+    if not user or not user.check_password(body.password):
+        return ojsonify({'error': 'Invalid credentials'}, 401)
+
+    # Transparently upgrade hashes stored with a different cost factor.
+    if user.password_needs_rehash():
+        user.set_password(body.password)
+        db.session.commit()
+
     access_token = create_access_token(identity=user.id)
-    return jsonify({
+    return ojsonify({
         'access_token': access_token,
         'user': {
             'id': user.id,
@@ -99,64 +178,138 @@ def login():
 @jwt_required()
 def create_ride():
     current_user_id = get_jwt_identity()
-    data = request.get_json()
-    
+    body = parse_body(CreateRideBody)
+
     ride = Ride(
-        start_location=data['start_location'],
-        end_location=data['end_location'],
-        available_seats=data['available_seats'],
-        departure_time=datetime.fromisoformat(data['departure_time']),
-        price=data['price'],
+        start_location=body.start_location,
+        end_location=body.end_location,
+        available_seats=body.available_seats,
+        departure_time=body.departure_time,
+        price=body.price,
         driver_id=current_user_id
     )
     
-    db.session.add(ride)
-    db.session.commit()
-    
-    return jsonify({
+    # Single explicit transaction: flush assigns the id, commit happens once
+    # at block exit.
+    with db.session.begin():
+        db.session.add(ride)
+        db.session.flush()
+        ride_id = ride.id
+
+    return ojsonify({
         'message': 'Ride created successfully',
-        'ride_id': ride.id
-    }), 201
+        'ride_id': ride_id
+    }, 201)
+
+# Page size for ride search; keeps response size bounded as the table grows.
+SEARCH_PAGE_SIZE = 50
+
+# Response DTOs for search results. orjson serializes dataclasses natively
+# at C speed, so no intermediate per-row dicts are built in Python.
+@dataclass(slots=True)
+class DriverDTO:
+    id: int
+    name: str
+
+@dataclass(slots=True)
+class RideDTO:
+    id: int
+    start_location: str
+    end_location: str
+    available_seats: int
+    departure_time: datetime
+    price: float
+    driver: DriverDTO
+
+# Static part of the search statement, built once at import; per-request
+# code only appends the dynamic filters.
+_SEARCH_BASE_STMT = (
+    sqlalchemy.select(
+        Ride.id,
+        Ride.start_location,
+        Ride.end_location,
+        Ride.available_seats,
+        Ride.departure_time,
+        Ride.price,
+        User.id,
+        User.name,
+    )
+    .join(User, User.id == Ride.driver_id)
+    .where(Ride.status == 'active')
+    .order_by(Ride.departure_time)
+    .limit(SEARCH_PAGE_SIZE)
+)
 
 @app.route('/api/rides/search', methods=['GET'])
+@cache.cached(timeout=15, query_string=True)
 def search_rides():
     start = request.args.get('start')
     end = request.args.get('end')
     date = request.args.get('date')
-    
-    query = Ride.query.filter_by(status='active')
-    
+    cursor = request.args.get('cursor')
+
+    # Column-only statement: skips ORM instance hydration and session
+    # tracking, and the join replaces the driver relationship load.
+    stmt = _SEARCH_BASE_STMT
+
+    # Prefix match (no leading wildcard) so the location filters stay sargable.
     if start:
-        query = query.filter(Ride.start_location.ilike(f'%{start}%'))
+        stmt = stmt.where(Ride.start_location.ilike(f'{start}%'))
     if end:
-        query = query.filter(Ride.end_location.ilike(f'%{end}%'))
+        stmt = stmt.where(Ride.end_location.ilike(f'{end}%'))
     if date:
-        date_obj = datetime.fromisoformat(date)
-        query = query.filter(Ride.departure_time >= date_obj)
-    
-    rides = query.all()
-    return jsonify([{
-        'id': ride.id,
-        'start_location': ride.start_location,
-        'end_location': ride.end_location,
-        'available_seats': ride.available_seats,
-        'departure_time': ride.departure_time.isoformat(),
-        'price': ride.price,
-        'driver': {
-            'id': ride.driver.id,
-            'name': ride.driver.name
-        }
-    } for ride in rides])
+        # Accept a unix timestamp or a YYYY-MM-DD date; date.fromisoformat
+        # is cheaper than the full datetime parser.
+        try:
+            if date.isdigit():
+                date_obj = datetime.utcfromtimestamp(int(date))
+            else:
+                date_obj = datetime.combine(date_type.fromisoformat(date), time.min)
+        except (ValueError, OverflowError):
+            return ojsonify({'error': 'Invalid date; use YYYY-MM-DD or a unix timestamp'}, 400)
+        stmt = stmt.where(Ride.departure_time >= date_obj)
+    else:
+        # Without an explicit date, never scan or return past rides.
+        stmt = stmt.where(Ride.departure_time >= datetime.utcnow())
+
+    # Keyset pagination: pass the last departure_time of the previous page
+    # as ?cursor= to fetch the next one.
+    if cursor:
+        try:
+            cursor_dt = datetime.fromisoformat(cursor)
+        except ValueError:
+            return ojsonify({'error': 'Invalid cursor; use an ISO 8601 datetime'}, 400)
+        stmt = stmt.where(Ride.departure_time > cursor_dt)
+
+    rows = db.session.execute(stmt).all()
+    return ojsonify([
+        RideDTO(*row[:6], driver=DriverDTO(row[6], row[7])) for row in rows
+    ])
 
 @app.route('/api/rides/<int:ride_id>', methods=['GET'])
+@cache.memoize(timeout=30)
 def get_ride(ride_id):
-    ride = Ride.query.get_or_404(ride_id)
-    return jsonify({
+    ride = Ride.query.options(
+        *_loader_options(selectinload(Ride.driver))
+    ).get_or_404(ride_id)
+
+    # Requests come back as plain (id, status, passenger id, passenger name)
+    # tuples; one joined query, no per-row relationship attribute dispatch.
+    request_rows = db.session.query(
+        RideRequest.id,
+        RideRequest.status,
+        User.id,
+        User.name,
+    ).join(User, User.id == RideRequest.passenger_id).filter(
+        RideRequest.ride_id == ride_id
+    ).all()
+
+    return ojsonify({
         'id': ride.id,
         'start_location': ride.start_location,
         'end_location': ride.end_location,
         'available_seats': ride.available_seats,
-        'departure_time': ride.departure_time.isoformat(),
+        'departure_time': ride.departure_time,
         'price': ride.price,
         'status': ride.status,
         'driver': {
@@ -164,13 +317,13 @@ def get_ride(ride_id):
             'name': ride.driver.name
         },
         'requests': [{
-            'id': req.id,
-            'status': req.status,
+            'id': row[0],
+            'status': row[1],
             'passenger': {
-                'id': req.passenger.id,
-                'name': req.passenger.name
+                'id': row[2],
+                'name': row[3]
             }
-        } for req in ride.requests]
+        } for row in request_rows]
     })
 
 @app.route('/api/rides/<int:ride_id>/request', methods=['POST'])
@@ -180,53 +333,72 @@ def request_ride(ride_id):
     ride = Ride.query.get_or_404(ride_id)
     
     if ride.status != 'active':
-        return jsonify({'error': 'Ride is not active'}), 400
+        return ojsonify({'error': 'Ride is not active'}, 400)
     
     if ride.available_seats <= 0:
-        return jsonify({'error': 'No seats available'}), 400
-    
-    existing_request = RideRequest.query.filter_by(
-        ride_id=ride_id,
-        passenger_id=current_user_id
-    ).first()
-    
-    if existing_request:
-        return jsonify({'error': 'You have already requested this ride'}), 400
+        return ojsonify({'error': 'No seats available'}, 400)
     
-    request = RideRequest(
+    # Single round-trip insert: the unique (ride_id, passenger_id) index
+    # rejects duplicates, so no existence SELECT is needed. The constraint
+    # violation is the duplicate signal; rowcount is unreliable here because
+    # CLIENT_FOUND_ROWS makes a no-op upsert report 1 affected row.
+    ride_request = RideRequest(
         ride_id=ride_id,
         passenger_id=current_user_id
     )
-    
-    db.session.add(request)
-    db.session.commit()
-    
-    return jsonify({'message': 'Ride request sent successfully'}), 201
+    db.session.add(ride_request)
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return ojsonify({'error': 'You have already requested this ride'}, 400)
+
+    cache.delete_memoized(get_ride, ride_id)
+
+    return ojsonify({'message': 'Ride request sent successfully'}, 201)
 
 @app.route('/api/ride-requests/<int:request_id>', methods=['PATCH'])
 @jwt_required()
 def update_ride_request(request_id):
     current_user_id = get_jwt_identity()
-    ride_request = RideRequest.query.get_or_404(request_id)
-    
+    ride_request = RideRequest.query.options(
+        joinedload(RideRequest.ride)
+    ).get_or_404(request_id)
+
     # Check if the current user is the driver of the ride
     if ride_request.ride.driver_id != current_user_id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    data = request.get_json()
-    new_status = data.get('status')
-    
+        return ojsonify({'error': 'Unauthorized'}, 403)
+
+    new_status = parse_body(UpdateRideRequestBody).status
+
     if new_status not in ['accepted', 'rejected']:
-        return jsonify({'error': 'Invalid status'}), 400
-    
+        return ojsonify({'error': 'Invalid status'}, 400)
+
     ride_request.status = new_status
-    
+
     if new_status == 'accepted':
-        ride_request.ride.available_seats -= 1
-    
+        # Conditional UPDATE so concurrent approvals cannot oversubscribe the
+        # ride: the decrement only lands while seats remain.
+        updated = db.session.query(Ride).filter(
+            Ride.id == ride_request.ride_id,
+            Ride.available_seats > 0
+        ).update(
+            {Ride.available_seats: Ride.available_seats - 1},
+            synchronize_session=False
+        )
+        if not updated:
+            db.session.rollback()
+            return ojsonify({'error': 'No seats available'}, 409)
+
     db.session.commit()
-    
-    return jsonify({'message': 'Ride request updated successfully'})
+
+    cache.delete_memoized(get_ride, ride_request.ride_id)
+
+    return ojsonify({'message': 'Ride request updated successfully'})
 
 if __name__ == '__main__':
+    # Development only. Production runs under gunicorn (see Procfile); the
+    # Flask dev server handles one request at a time and caps throughput
+    # no matter what the rest of the stack does.
     app.run(debug=True) 
\ No newline at end of file
@@ -1,26 +1,44 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import bcrypt
 
 db = SQLAlchemy()
 
+# Default bcrypt cost; overridable via the BCRYPT_ROUNDS app config so the
+# work factor can be raised later without a code change.
+DEFAULT_BCRYPT_ROUNDS = 10
+
+def _bcrypt_rounds():
+    return current_app.config.get('BCRYPT_ROUNDS', DEFAULT_BCRYPT_ROUNDS)
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    # bcrypt output is 60 bytes; stored raw so checks skip a str/bytes round trip
+    password_hash = db.Column(db.LargeBinary(60), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
-    rides_offered = db.relationship('Ride', backref='driver', lazy=True)
-    ride_requests = db.relationship('RideRequest', backref='passenger', lazy=True)
+    rides_offered = db.relationship('Ride', back_populates='driver', lazy=True)
+    ride_requests = db.relationship('RideRequest', back_populates='passenger', lazy=True)
 
     def set_password(self, password):
-        salt = bcrypt.gensalt()
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+        salt = bcrypt.gensalt(rounds=_bcrypt_rounds())
+        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), salt)
 
     def check_password(self, password):
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash)
+
+    def password_needs_rehash(self):
+        # Hash format is $2b$<cost>$<salt+digest>; compare the embedded cost
+        # against the currently configured work factor.
+        try:
+            stored_rounds = int(self.password_hash.split(b'$')[2])
+        except (IndexError, ValueError):
+            return True
+        return stored_rounds != _bcrypt_rounds()
 
 class Ride(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -36,7 +54,13 @@ class Ride(db.Model):
     driver_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     
     # Relationships
-    requests = db.relationship('RideRequest', backref='ride', lazy=True)
+    driver = db.relationship('User', back_populates='rides_offered')
+    requests = db.relationship('RideRequest', back_populates='ride', lazy=True)
+
+    __table_args__ = (
+        # Covers the search filter: status equality plus departure_time range.
+        db.Index('ix_ride_status_departure', 'status', 'departure_time'),
+    )
 
 class RideRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -45,4 +69,15 @@ class RideRequest(db.Model):
     
     # Foreign Keys
     ride_id = db.Column(db.Integer, db.ForeignKey('ride.id'), nullable=False)
-    passenger_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) 
\ No newline at end of file
+    passenger_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    # Relationships
+    ride = db.relationship('Ride', back_populates='requests')
+    passenger = db.relationship('User', back_populates='ride_requests')
+
+    __table_args__ = (
+        # A passenger may only request a ride once; also serves the
+        # duplicate-request lookup in request_ride.
+        db.Index('ix_riderequest_ride_passenger', 'ride_id', 'passenger_id',
+                 unique=True),
+    ) 
\ No newline at end of file